@@ -1,12 +1,26 @@
+# Patch the standard library before anything else imports it, so blocking
+# socket calls (including redis-py's) and threads become cooperative greenlets
+from gevent import monkey
+monkey.patch_all()
+
 from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, Namespace, emit
 import json
 import os
 import logging
-from datetime import datetime
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, is_dataclass
+from typing import Any
 from dotenv import load_dotenv
 from redis_client import RedisClient
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -18,33 +32,131 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@dataclass
+class MessageEntry:
+    """A sent or received message as shown in the web interface"""
+    __slots__ = ('timestamp', 'channel', 'data', 'type')
+    timestamp: float  # Unix seconds, formatted by the client
+    channel: str
+    data: Any
+    type: str  # 'sent' or 'received'
+
+
+def _encode_dataclass(obj):
+    """json.dumps default hook encoding dataclasses such as MessageEntry"""
+    if is_dataclass(obj):
+        return asdict(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class SocketIOJSON:
+    """JSON module for Socket.IO packets, using orjson (which encodes dataclasses natively) when installed"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj).decode()
+            except TypeError:
+                # Values orjson cannot encode get the stdlib's error handling
+                pass
+        return json.dumps(obj, default=_encode_dataclass, **kwargs)
+
+    @staticmethod
+    def loads(s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'redis-pubsub-secret-key')
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='gevent', json=SocketIOJSON)
 
 # Global Redis client instance
-redis_client = RedisClient()
-
-# Message history storage (in-memory)
-message_history = []
-
-
-def on_redis_message(channel: str, data):
-    """Callback function when Redis message is received"""
-    logger.info(f'Received message on channel {channel}')
-    message_entry = {
-        'timestamp': datetime.now().isoformat(),
-        'channel': channel,
-        'data': data,
-        'type': 'received'
-    }
-    message_history.append(message_entry)
-    # Keep only last 100 messages
-    if len(message_history) > 100:
-        message_history.pop(0)
-    
-    # Emit to all connected clients
-    socketio.emit('redis_message', message_entry)
+redis_client = RedisClient(payload_format=os.getenv('REDIS_PAYLOAD_FORMAT', 'json').lower())
+
+# Message history storage (in-memory, oldest entries evicted automatically).
+# Only as many messages are kept as a newly connected client is sent.
+MESSAGE_HISTORY_SIZE = 50
+message_history = deque(maxlen=MESSAGE_HISTORY_SIZE)
+_history_snapshot = None
+
+# Subscription status broadcasts are coalesced over this window
+STATUS_BROADCAST_DELAY = 0.05  # seconds
+
+# Message broadcasts skip clients with more than this many packets still waiting
+# in their engine.io send queue, so a stalled client cannot grow memory without bound.
+# Each packet is a batch of up to 32 received messages, so this allows roughly
+# 1000 messages of backlog. This drops the newest messages, not the oldest:
+# a skipped client permanently misses those messages and is not told about the
+# gap; it simply receives later broadcasts again once its queue drains.
+CLIENT_BACKLOG_LIMIT = 32
+
+
+def add_to_history(message_entries: list[MessageEntry]):
+    """Append messages to the history and invalidate the cached snapshot"""
+    global _history_snapshot
+    message_history.extend(message_entries)
+    _history_snapshot = None
+
+
+def get_history_snapshot() -> list:
+    """Return the message history as a list, rebuilt only after it changes"""
+    global _history_snapshot
+    if _history_snapshot is None:
+        _history_snapshot = list(message_history)
+    return _history_snapshot
+
+
+def get_backlogged_clients() -> list[str]:
+    """Return the session ids of clients whose engine.io send queue exceeds CLIENT_BACKLOG_LIMIT"""
+    # Relies on python-socketio/engine.io internals; if they change, skip nobody
+    # rather than stop message delivery
+    try:
+        server = socketio.server
+        backlogged = []
+        for sid, eio_sid in server.manager.get_participants('/', None):
+            eio_socket = server.eio.sockets.get(eio_sid)
+            if eio_socket is not None and eio_socket.queue.qsize() > CLIENT_BACKLOG_LIMIT:
+                backlogged.append(sid)
+        return backlogged
+    except Exception as e:
+        logger.error(f'Failed to check client backlogs: {e}')
+        return []
+
+
+def broadcast(event: str, payload, skip_backlogged: bool = False):
+    """Emit an event to all connected clients (optionally skipping backlogged ones).
+
+    python-socketio encodes a callback-less broadcast packet once and reuses
+    it for every recipient, so the payload is passed as-is rather than
+    pre-encoded (which would turn it into a string on the client side).
+    """
+    try:
+        backlogged = get_backlogged_clients() if skip_backlogged else []
+        if backlogged:
+            logger.warning(f'Skipping {len(backlogged)} backlogged client(s) for {event}; they will not receive it')
+        socketio.emit(event, payload, skip_sid=backlogged)
+    except Exception as e:
+        logger.error(f'Failed to broadcast {event}: {e}')
+
+
+def record_and_broadcast(message_entries: list[MessageEntry]):
+    """Add messages to the history and broadcast them to all connected clients as one batch"""
+    add_to_history(message_entries)
+    broadcast('redis_message_batch', message_entries, skip_backlogged=True)
+
+
+def on_redis_messages(messages: list):
+    """Callback function when a batch of Redis messages is received"""
+    logger.info(f'Received {len(messages)} message(s) from Redis')
+    timestamp = time.time()
+    record_and_broadcast([
+        MessageEntry(timestamp, channel, data, 'received')
+        for channel, data in messages
+    ])
 
 
 @app.route('/')
@@ -53,184 +165,183 @@ def index():
     return render_template('index.html')
 
 
-@socketio.on('connect')
-def handle_connect():
-    """Handle client connection"""
-    logger.info('Client connected')
-    emit('connection_status', {'connected': True})
-    # Send current connection status
-    emit('redis_connection_status', {
-        'connected': redis_client.is_connected(),
-        'channels': list(redis_client.subscribed_channels)
-    })
-    # Send message history
-    emit('message_history', message_history[-50:])  # Last 50 messages
-
-
-@socketio.on('disconnect')
-def handle_disconnect():
-    """Handle client disconnection"""
-    logger.info('Client disconnected')
-
-
-@socketio.on('redis_connect')
-def handle_redis_connect(data):
-    """Handle Redis connection request"""
-    host = data.get('host', 'localhost')
-    port = int(data.get('port', 6379))
-    password = data.get('password', '')
-    db = int(data.get('db', 0))
-    
-    logger.info(f'Attempting to connect to Redis at {host}:{port} (db={db})')
-    success, message = redis_client.connect(host, port, password, db)
-    
-    if success:
-        logger.info(f'Successfully connected to Redis at {host}:{port}')
-    else:
-        logger.warning(f'Failed to connect to Redis at {host}:{port}: {message}')
-    
-    emit('redis_connection_result', {
-        'success': success,
-        'message': message,
-        'connected': redis_client.is_connected()
-    })
-
-
-@socketio.on('redis_disconnect')
-def handle_redis_disconnect():
-    """Handle Redis disconnection request"""
-    logger.info('Disconnecting from Redis')
-    redis_client.disconnect()
-    emit('redis_connection_result', {
-        'success': True,
-        'message': 'Disconnected from Redis',
-        'connected': False
-    })
-    socketio.emit('redis_connection_status', {
-        'connected': False,
-        'channels': []
-    })
-
-
-@socketio.on('redis_publish')
-def handle_redis_publish(data):
-    """Handle publish message request"""
-    channel = data.get('channel', '')
-    message = data.get('message', {})
-    
-    if not channel:
-        logger.warning('Publish attempt without channel name')
-        emit('publish_result', {
-            'success': False,
-            'message': 'Channel name is required'
+class RedisNamespace(Namespace):
+    """Socket.IO event handlers for the web interface"""
+
+    def __init__(self, namespace: str, redis_client: RedisClient):
+        super().__init__(namespace)
+        self.redis_client = redis_client
+        self._status_broadcast_pending = False
+        self._status_broadcast_lock = threading.Lock()
+
+    def schedule_status_broadcast(self):
+        """Broadcast the Redis connection status once a burst of (un)subscribes settles"""
+        with self._status_broadcast_lock:
+            if self._status_broadcast_pending:
+                return
+            self._status_broadcast_pending = True
+        socketio.start_background_task(self._broadcast_status_after_delay)
+
+    def _broadcast_status_after_delay(self):
+        """Wait out the coalescing window, then broadcast the current status"""
+        socketio.sleep(STATUS_BROADCAST_DELAY)
+        with self._status_broadcast_lock:
+            self._status_broadcast_pending = False
+        broadcast('redis_connection_status', {
+            'connected': self.redis_client.is_connected(),
+            'channels': self.redis_client.channels_snapshot
         })
-        return
-    
-    # Validate JSON message
-    if isinstance(message, str):
-        try:
-            message = json.loads(message)
-        except json.JSONDecodeError as e:
-            logger.warning(f'Invalid JSON format in publish message: {e}')
+
+    def on_connect(self):
+        """Handle client connection"""
+        logger.info('Client connected')
+        emit('connection_status', {'connected': True})
+        # Send current connection status
+        emit('redis_connection_status', {
+            'connected': self.redis_client.is_connected(verify=True),
+            'channels': self.redis_client.channels_snapshot
+        })
+        # Send message history
+        emit('message_history', get_history_snapshot())
+
+    def on_disconnect(self):
+        """Handle client disconnection"""
+        logger.info('Client disconnected')
+
+    def on_redis_connect(self, data):
+        """Handle Redis connection request"""
+        host = data.get('host', 'localhost')
+        port = int(data.get('port', 6379))
+        password = data.get('password', '')
+        db = int(data.get('db', 0))
+        
+        logger.info(f'Attempting to connect to Redis at {host}:{port} (db={db})')
+        success, message = self.redis_client.connect(host, port, password, db)
+        
+        if success:
+            logger.info(f'Successfully connected to Redis at {host}:{port}')
+        else:
+            logger.warning(f'Failed to connect to Redis at {host}:{port}: {message}')
+        
+        emit('redis_connection_result', {
+            'success': success,
+            'message': message,
+            'connected': self.redis_client.is_connected()
+        })
+
+    def on_redis_disconnect(self):
+        """Handle Redis disconnection request"""
+        logger.info('Disconnecting from Redis')
+        self.redis_client.disconnect()
+        emit('redis_connection_result', {
+            'success': True,
+            'message': 'Disconnected from Redis',
+            'connected': False
+        })
+        broadcast('redis_connection_status', {
+            'connected': False,
+            'channels': []
+        })
+
+    def on_redis_publish(self, data):
+        """Handle publish message request"""
+        channel = data.get('channel', '')
+        message = data.get('message', {})
+        
+        if not channel:
+            logger.warning('Publish attempt without channel name')
             emit('publish_result', {
                 'success': False,
-                'message': 'Invalid JSON format'
+                'message': 'Channel name is required'
             })
             return
-    
-    logger.info(f'Publishing message to channel: {channel}')
-    success, result_message = redis_client.publish(channel, message)
-    
-    if success:
-        logger.info(f'Message published successfully to channel: {channel}')
-        # Add to history
-        message_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'channel': channel,
-            'data': message,
-            'type': 'sent'
-        }
-        message_history.append(message_entry)
-        if len(message_history) > 100:
-            message_history.pop(0)
         
-        # Emit to all clients
-        socketio.emit('redis_message', message_entry)
-    else:
-        logger.error(f'Failed to publish message to channel {channel}: {result_message}')
-    
-    emit('publish_result', {
-        'success': success,
-        'message': result_message
-    })
-
+        # Validate JSON message
+        if isinstance(message, str):
+            try:
+                message = json.loads(message)
+            except json.JSONDecodeError as e:
+                logger.warning(f'Invalid JSON format in publish message: {e}')
+                emit('publish_result', {
+                    'success': False,
+                    'message': 'Invalid JSON format'
+                })
+                return
+        
+        logger.info(f'Publishing message to channel: {channel}')
+        success, result_message = self.redis_client.publish(channel, message)
+        
+        if success:
+            logger.info(f'Message published successfully to channel: {channel}')
+            record_and_broadcast([MessageEntry(time.time(), channel, message, 'sent')])
+        else:
+            logger.error(f'Failed to publish message to channel {channel}: {result_message}')
+        
+        emit('publish_result', {
+            'success': success,
+            'message': result_message
+        })
 
-@socketio.on('redis_subscribe')
-def handle_redis_subscribe(data):
-    """Handle subscribe to channel request"""
-    channel = data.get('channel', '')
-    
-    if not channel:
-        logger.warning('Subscribe attempt without channel name')
+    def on_redis_subscribe(self, data):
+        """Handle subscribe to channel request"""
+        channel = data.get('channel', '')
+        
+        if not channel:
+            logger.warning('Subscribe attempt without channel name')
+            emit('subscribe_result', {
+                'success': False,
+                'message': 'Channel name is required'
+            })
+            return
+        
+        logger.info(f'Subscribing to channel: {channel}')
+        success, result_message = self.redis_client.subscribe(channel, on_redis_messages)
+        
+        if success:
+            logger.info(f'Successfully subscribed to channel: {channel}')
+        else:
+            logger.warning(f'Failed to subscribe to channel {channel}: {result_message}')
+        
         emit('subscribe_result', {
-            'success': False,
-            'message': 'Channel name is required'
+            'success': success,
+            'message': result_message,
+            'channel': channel
         })
-        return
-    
-    logger.info(f'Subscribing to channel: {channel}')
-    success, result_message = redis_client.subscribe(channel, on_redis_message)
-    
-    if success:
-        logger.info(f'Successfully subscribed to channel: {channel}')
-    else:
-        logger.warning(f'Failed to subscribe to channel {channel}: {result_message}')
-    
-    emit('subscribe_result', {
-        'success': success,
-        'message': result_message,
-        'channel': channel
-    })
-    
-    # Update all clients with current subscription status
-    socketio.emit('redis_connection_status', {
-        'connected': redis_client.is_connected(),
-        'channels': list(redis_client.subscribed_channels)
-    })
-
+        
+        # Update all clients with current subscription status
+        self.schedule_status_broadcast()
 
-@socketio.on('redis_unsubscribe')
-def handle_redis_unsubscribe(data):
-    """Handle unsubscribe from channel request"""
-    channel = data.get('channel', '')
-    
-    if not channel:
-        logger.warning('Unsubscribe attempt without channel name')
+    def on_redis_unsubscribe(self, data):
+        """Handle unsubscribe from channel request"""
+        channel = data.get('channel', '')
+        
+        if not channel:
+            logger.warning('Unsubscribe attempt without channel name')
+            emit('unsubscribe_result', {
+                'success': False,
+                'message': 'Channel name is required'
+            })
+            return
+        
+        logger.info(f'Unsubscribing from channel: {channel}')
+        success, result_message = self.redis_client.unsubscribe(channel)
+        
+        if success:
+            logger.info(f'Successfully unsubscribed from channel: {channel}')
+        else:
+            logger.warning(f'Failed to unsubscribe from channel {channel}: {result_message}')
+        
         emit('unsubscribe_result', {
-            'success': False,
-            'message': 'Channel name is required'
+            'success': success,
+            'message': result_message,
+            'channel': channel
         })
-        return
-    
-    logger.info(f'Unsubscribing from channel: {channel}')
-    success, result_message = redis_client.unsubscribe(channel)
-    
-    if success:
-        logger.info(f'Successfully unsubscribed from channel: {channel}')
-    else:
-        logger.warning(f'Failed to unsubscribe from channel {channel}: {result_message}')
-    
-    emit('unsubscribe_result', {
-        'success': success,
-        'message': result_message,
-        'channel': channel
-    })
-    
-    # Update all clients with current subscription status
-    socketio.emit('redis_connection_status', {
-        'connected': redis_client.is_connected(),
-        'channels': list(redis_client.subscribed_channels)
-    })
+        
+        # Update all clients with current subscription status
+        self.schedule_status_broadcast()
+
+
+socketio.on_namespace(RedisNamespace('/', redis_client))
 
 
 if __name__ == '__main__':
@@ -1,35 +1,212 @@
 import redis
+import base64
 import json
 import logging
+import socket
 import threading
-from typing import Optional, Callable
+from typing import Any, Optional, Callable, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 logger = logging.getLogger(__name__)
 
+# Kernel send/receive buffer size for Redis sockets
+SOCKET_BUFFER_SIZE = 1 << 20  # bytes
+
+# Start TCP keepalive probes after the connection has been idle this long
+SOCKET_KEEPALIVE_OPTIONS = {socket.TCP_KEEPIDLE: 60} if hasattr(socket, 'TCP_KEEPIDLE') else {}
+
+# Batched delivery: received messages are handed to the callback every interval
+# or once a batch fills up
+DISPATCH_BATCH_SIZE = 32
+DISPATCH_FLUSH_INTERVAL = 0.005  # seconds
+
+# How long the listening thread blocks waiting for a message before re-checking for stop()
+LISTEN_POLL_INTERVAL = 0.1  # seconds
+
+# Supported payload encodings for published messages
+PAYLOAD_FORMATS = ('json', 'msgpack')
+
+# Prefix for msgpack payloads: 0xC1 is never used by msgpack and cannot start a
+# JSON document, followed by the framing version
+MSGPACK_MAGIC = b'\xc1\x01'
+
+
+def dumps(message, payload_format: str = 'json') -> Union[bytes, str]:
+    """Encode a message as JSON (using orjson when installed) or as framed msgpack"""
+    if payload_format == 'msgpack':
+        return MSGPACK_MAGIC + msgpack.packb(message, use_bin_type=True)
+    if orjson is not None:
+        try:
+            return orjson.dumps(message)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the stdlib encodes fine
+            pass
+    return json.dumps(message)
+
+
+def _json_safe(value):
+    """Convert binary values in decoded msgpack data to text so it can be re-encoded as JSON"""
+    if isinstance(value, bytes):
+        try:
+            return value.decode()
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode()
+    if isinstance(value, dict):
+        return {_json_safe(key): _json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_json_safe(item) for item in value]
+    return value
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> dict:
+    """Represent msgpack extension types as JSON objects"""
+    return {'ext_type': code, 'data': base64.b64encode(data).decode()}
+
+
+def loads(payload: Union[bytes, str]):
+    """Decode a framed msgpack message, or a JSON message (using orjson when installed)"""
+    if msgpack is not None and isinstance(payload, bytes) and payload.startswith(MSGPACK_MAGIC):
+        try:
+            # Timestamps decode as Unix seconds; binary and ext values become text
+            return _json_safe(msgpack.unpackb(
+                payload[len(MSGPACK_MAGIC):],
+                raw=False,
+                timestamp=1,
+                ext_hook=_msgpack_ext_hook
+            ))
+        except ValueError:
+            # Not a valid msgpack frame, fall back to JSON
+            pass
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+class TunedConnection(redis.Connection):
+    """Redis connection with enlarged kernel socket buffers"""
+
+    def _connect(self):
+        # redis-py already sets TCP_NODELAY on TCP connections
+        sock = super()._connect()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        return sock
+
+
+class MessageBatcher:
+    """Collect items and hand them to a callback in batches from a background thread"""
+
+    def __init__(self, deliver: Callable[[list], None], batch_size: int, interval: float):
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.interval = interval
+        self._items: list = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._batch_full = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the delivery thread"""
+        if self._thread:
+            return
+        self._wakeup.clear()
+        self._batch_full.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1):
+        """Stop the delivery thread once it has delivered everything already added"""
+        thread, self._thread = self._thread, None
+        self._wakeup.set()
+        self._batch_full.set()
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=timeout)
+
+    def add(self, item):
+        """Queue an item for the next batch"""
+        with self._lock:
+            self._items.append(item)
+            if len(self._items) == 1:
+                self._wakeup.set()
+            if len(self._items) >= self.batch_size:
+                self._batch_full.set()
+
+    def _run(self):
+        """Internal method delivering batches until stopped or replaced by a newer thread"""
+        current = threading.current_thread()
+        while self._thread is current:
+            # Sleep until an item arrives, then give the batch one interval to fill
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self._batch_full.wait(self.interval)
+            self._batch_full.clear()
+            self._drain()
+        if self._thread is None:
+            # Stopped rather than replaced: this thread still owns what is left
+            self._drain()
+
+    def _drain(self):
+        """Deliver queued items, batch_size at a time"""
+        while True:
+            with self._lock:
+                batch = self._items[:self.batch_size]
+                del self._items[:self.batch_size]
+            if not batch:
+                return
+            try:
+                self.deliver(batch)
+            except Exception as e:
+                logger.error(f'Failed to deliver a batch of {len(batch)} items: {e}')
+
 
 class RedisClient:
-    def __init__(self):
+    def __init__(self, payload_format: str = 'json'):
+        if payload_format not in PAYLOAD_FORMATS:
+            raise ValueError(f"Unsupported payload format: {payload_format}")
+        if payload_format == 'msgpack' and msgpack is None:
+            raise ValueError("The msgpack payload format requires the msgpack package")
+        self.payload_format = payload_format
         self.redis_client: Optional[redis.Redis] = None
         self.pubsub: Optional[redis.client.PubSub] = None
         self.subscribed_channels = set()
+        self._channels_snapshot: tuple[str, ...] = ()
         self.message_callback: Optional[Callable] = None
-        self.listener_thread: Optional[threading.Thread] = None
+        self.listener_thread: Optional[redis.client.PubSubWorkerThread] = None
         self.is_listening = False
+        self._dispatcher = MessageBatcher(self._deliver_batch, DISPATCH_BATCH_SIZE, DISPATCH_FLUSH_INTERVAL)
+        self._connected = False
 
     def connect(self, host: str, port: int, password: str, db: int = 0) -> tuple[bool, str]:
         """Connect to Redis server"""
         try:
             self.disconnect()
-            self.redis_client = redis.Redis(
+            pool = redis.ConnectionPool(
+                connection_class=TunedConnection,
                 host=host,
                 port=port,
                 password=password if password else None,
                 db=db,
-                decode_responses=True,
-                socket_connect_timeout=5
+                # Keep replies as bytes; payloads are decoded by loads() and
+                # channel names once per message in the listener
+                decode_responses=False,
+                socket_connect_timeout=5,
+                socket_keepalive=True,
+                socket_keepalive_options=SOCKET_KEEPALIVE_OPTIONS
             )
+            self.redis_client = redis.Redis(connection_pool=pool)
             # Test connection
             self.redis_client.ping()
+            self._connected = True
             return True, "Connected successfully"
         except redis.ConnectionError as e:
             return False, f"Connection failed: {str(e)}"
@@ -50,36 +227,53 @@ class RedisClient:
         if self.redis_client:
             try:
                 self.redis_client.close()
+                # Redis.close() leaves externally created pools open
+                self.redis_client.connection_pool.disconnect()
             except:
                 pass
             self.redis_client = None
+        self._connected = False
         self.subscribed_channels.clear()
+        self._channels_snapshot = ()
 
-    def is_connected(self) -> bool:
-        """Check if connected to Redis"""
+    @property
+    def channels_snapshot(self) -> tuple[str, ...]:
+        """Subscribed channels as a tuple, rebuilt only when subscriptions change"""
+        return self._channels_snapshot
+
+    def is_connected(self, verify: bool = False) -> bool:
+        """Check if connected to Redis (pass verify=True to probe the server with PING)"""
         if not self.redis_client:
             return False
-        try:
-            self.redis_client.ping()
-            return True
-        except:
-            return False
+        if verify:
+            try:
+                self.redis_client.ping()
+                self._connected = True
+            except:
+                self._connected = False
+        return self._connected
 
     def publish(self, channel: str, message: dict) -> tuple[bool, str]:
-        """Publish a JSON message to a Redis channel"""
-        if not self.is_connected():
+        """Publish a message to a Redis channel"""
+        if not self.redis_client:
             return False, "Not connected to Redis"
         
         try:
-            message_str = json.dumps(message)
-            self.redis_client.publish(channel, message_str)
+            payload = dumps(message, self.payload_format)
+            # No pre-flight PING: redis-py reconnects on its own, and the
+            # command's outcome tells us whether the server is reachable
+            self.redis_client.publish(channel, payload)
+            self._connected = True
             return True, "Message published successfully"
+        except redis.ConnectionError as e:
+            self._connected = False
+            return False, f"Publish failed: {str(e)}"
         except Exception as e:
             return False, f"Publish failed: {str(e)}"
 
     def subscribe(self, channel: str, callback: Callable) -> tuple[bool, str]:
-        """Subscribe to a Redis channel"""
-        if not self.is_connected():
+        """Subscribe to a Redis channel; callback receives lists of (channel, data) tuples"""
+        if not self.redis_client:
             return False, "Not connected to Redis"
         
         if channel in self.subscribed_channels:
@@ -89,14 +283,19 @@ class RedisClient:
             if not self.pubsub:
                 self.pubsub = self.redis_client.pubsub()
             
-            self.pubsub.subscribe(channel)
+            self.pubsub.subscribe(**{channel: self._dispatch})
+            self._connected = True
             self.subscribed_channels.add(channel)
+            self._channels_snapshot = tuple(self.subscribed_channels)
             self.message_callback = callback
             
             if not self.is_listening:
                 self.start_listening()
             
             return True, f"Subscribed to {channel}"
+        except redis.ConnectionError as e:
+            self._connected = False
+            return False, f"Subscribe failed: {str(e)}"
         except Exception as e:
             return False, f"Subscribe failed: {str(e)}"
 
@@ -109,6 +308,7 @@ class RedisClient:
             if self.pubsub:
                 self.pubsub.unsubscribe(channel)
             self.subscribed_channels.discard(channel)
+            self._channels_snapshot = tuple(self.subscribed_channels)
             
             if len(self.subscribed_channels) == 0:
                 self.stop_listening()
@@ -123,38 +323,59 @@ class RedisClient:
             return
         
         self.is_listening = True
-        self.listener_thread = threading.Thread(target=self._listen, daemon=True)
-        self.listener_thread.start()
+        # Messages are delivered to _dispatch, the handler registered for every channel
+        self.listener_thread = self.pubsub.run_in_thread(
+            sleep_time=LISTEN_POLL_INTERVAL,
+            daemon=True,
+            exception_handler=self._on_listener_error
+        )
+        self._dispatcher.start()
+        logger.info('Started listening for Redis pub/sub messages')
 
     def stop_listening(self):
         """Stop listening thread"""
         self.is_listening = False
-        if self.listener_thread and self.listener_thread.is_alive():
-            self.listener_thread.join(timeout=1)
+        if self.listener_thread:
+            self.listener_thread.stop()
+            if self.listener_thread.is_alive():
+                self.listener_thread.join(timeout=1)
+            self.listener_thread = None
+            logger.info('Stopped listening for Redis pub/sub messages')
+        self._dispatcher.stop()
 
-    def _listen(self):
-        """Internal method to listen for messages"""
+    def _dispatch(self, message: dict):
+        """Internal handler for messages received on subscribed channels"""
+        channel = message['channel'].decode()
         try:
-            logger.info('Started listening for Redis pub/sub messages')
-            for message in self.pubsub.listen():
-                if not self.is_listening:
-                    break
-                
-                if message['type'] == 'message':
-                    try:
-                        data = json.loads(message['data'])
-                        logger.debug(f'Received message on channel {message["channel"]}: {data}')
-                        if self.message_callback:
-                            self.message_callback(message['channel'], data)
-                    except json.JSONDecodeError:
-                        # If message is not JSON, send as string
-                        logger.debug(f'Received non-JSON message on channel {message["channel"]}: {message["data"]}')
-                        if self.message_callback:
-                            self.message_callback(message['channel'], message['data'])
-        except Exception as e:
-            logger.error(f'Error in Redis pub/sub listener: {e}')
-            if self.message_callback:
-                self.message_callback('_error', {'error': str(e)})
-        finally:
-            logger.info('Stopped listening for Redis pub/sub messages')
+            data = loads(message['data'])
+            logger.debug(f'Received message on channel {channel}: {data}')
+        except ValueError:
+            # If message is not JSON, send as string (covers JSONDecodeError and
+            # the UnicodeDecodeError json.loads raises for non-UTF-8 bytes)
+            data = message['data'].decode(errors='replace')
+            logger.debug(f'Received non-JSON message on channel {channel}: {data}')
+        self._dispatcher.add((channel, data))
 
+    def _deliver_batch(self, batch: list[tuple[str, Any]]):
+        """Internal method handing a batch of received messages to the callback"""
+        if self.message_callback:
+            self.message_callback(batch)
+
+    def _on_listener_error(self, e: BaseException, pubsub: redis.client.PubSub,
+                           thread: redis.client.PubSubWorkerThread):
+        """Internal handler for errors raised in the listening thread"""
+        logger.error(f'Error in Redis pub/sub listener: {e}')
+        self.is_listening = False
+        if isinstance(e, (redis.ConnectionError, redis.TimeoutError)):
+            self._connected = False
+        # Once stopped, the worker thread closes this pubsub, dropping every
+        # subscription; forget them so the next subscribe starts from scratch
+        thread.stop()
+        self.pubsub = None
+        self.subscribed_channels.clear()
+        self._channels_snapshot = ()
+        # The dispatch thread delivers what is already queued before exiting;
+        # wait for it so the error below reaches clients after those messages
+        self._dispatcher.stop()
+        if self.message_callback:
+            self.message_callback([('_error', {'error': str(e)})])
@@ -81,8 +81,10 @@ socket.on('publish_result', (data) => {
     showMessage(publishResultMessage, data.message, data.success);
 });
 
-socket.on('redis_message', (message) => {
-    addMessageToDisplay(message);
+socket.on('redis_message_batch', (messages) => {
+    messages.forEach(msg => {
+        addMessageToDisplay(msg);
+    });
 });
 
 socket.on('message_history', (messages) => {
@@ -277,7 +279,8 @@ function addMessageToDisplay(message) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message-item ${message.type}`;
     
-    const timestamp = new Date(message.timestamp).toLocaleString();
+    // Server timestamps are Unix seconds
+    const timestamp = new Date(message.timestamp * 1000).toLocaleString();
     const messageType = message.type === 'sent' ? 'SENT' : 'RECEIVED';
     
     let formattedData;